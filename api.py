@@ -1,19 +1,36 @@
+import asyncio
+
 from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import Dict, List, Optional, Annotated
-from datetime import datetime
+from datetime import datetime, timezone
 import google.generativeai as genai
 from supabase import create_client, Client
 import os
+import tempfile
+import secrets
 from dotenv import load_dotenv
+from functools import lru_cache
+import heapq
 import logging
 import json
-from fuzzywuzzy import fuzz
+import re
+import orjson
+import time
+import hashlib
+import jwt
+from cachetools import TTLCache
+from rapidfuzz import fuzz, process as fuzz_process, utils as fuzz_utils
 
 # Initialize FastAPI app
-app = FastAPI(title="DocKeeper API", version="1.0.0")
+app = FastAPI(
+    title="DocKeeper API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # Configure CORS
 allowed_origins = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
@@ -28,6 +45,38 @@ app.add_middleware(
 # Load environment variables
 load_dotenv()
 
+@app.on_event("startup")
+async def expand_threadpool():
+    """Widen the anyio threadpool used for offloaded blocking SDK calls."""
+    import anyio
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 100
+
+async def _to_thread(fn, *args, **kwargs):
+    """Run a blocking SDK call on the threadpool so the event loop stays free."""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+# Gemini usually wraps JSON answers in a markdown code fence
+FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.S)
+
+def _doc_fields(doc: dict) -> Dict[str, str]:
+    """Field name -> value mapping from a document's embedded data points."""
+    return {
+        point['field_name']: point['field_value']
+        for point in doc.get('data_points') or []
+    }
+
+def _parse_gemini_json(text: str) -> dict:
+    """Extract and parse the JSON payload from a Gemini response."""
+    match = FENCE_RE.search(text)
+    payload = match.group(1) if match else text.strip()
+    # Gemini occasionally annotates the JSON with // comments
+    if "//" in payload:
+        payload = "\n".join(
+            line for line in payload.split("\n")
+            if not line.strip().startswith("//")
+        )
+    return orjson.loads(payload)
+
 # Initialize logging
 logging.basicConfig(
     level=logging.INFO,
@@ -38,7 +87,30 @@ logger = logging.getLogger(__name__)
 # Security scheme
 security = HTTPBearer()
 
-# Initialize Supabase client
+# Supabase signs access tokens with this shared secret; when configured we can
+# verify them locally instead of a network round-trip per request
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+
+# Short-lived cache of verified tokens so repeated requests with the same
+# bearer token skip re-verification entirely
+_TOKEN_CACHE: Dict[str, tuple] = {}
+_TOKEN_CACHE_TTL = 60  # seconds
+_TOKEN_CACHE_MAX = 1024
+
+# Per-user result caches: document lists change on upload (invalidated there),
+# categorization is deterministic per field set so it can live much longer
+DOC_CACHE = TTLCache(maxsize=1024, ttl=30)
+CATEGORY_CACHE = TTLCache(maxsize=1024, ttl=3600)
+
+# Upload limits: reject oversized PDFs early and spill large uploads to disk
+# instead of holding them in RAM
+MAX_PDF_BYTES = int(os.getenv("MAX_PDF_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = 8 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1 << 20
+
+# Initialize Supabase client (cached per process so the underlying httpx
+# connection pool is reused across requests)
+@lru_cache(maxsize=1)
 def get_supabase() -> Client:
     """Initialize and return Supabase client."""
     try:
@@ -58,16 +130,39 @@ async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> str:
     """Get current user from JWT token."""
+    token = credentials.credentials
+
+    cached = _TOKEN_CACHE.get(token)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    ttl = _TOKEN_CACHE_TTL
     try:
-        supabase = get_supabase()
-        # Verify the JWT token
-        user = supabase.auth.get_user(credentials.credentials)
-        if not user or not user.user:
-            raise HTTPException(
-                status_code=401,
-                detail="Invalid authentication credentials"
+        if SUPABASE_JWT_SECRET:
+            # Verify the JWT signature locally - no network round-trip
+            payload = jwt.decode(
+                token,
+                SUPABASE_JWT_SECRET,
+                algorithms=['HS256'],
+                audience='authenticated'
             )
-        return user.user.id
+            user_id = payload['sub']
+            # Cap the cache at the token's own expiry so a token accepted
+            # just before exp isn't honored for a further TTL window
+            if 'exp' in payload:
+                ttl = min(ttl, payload['exp'] - time.time())
+        else:
+            # No local secret configured; fall back to Supabase Auth
+            supabase = get_supabase()
+            user = await _to_thread(supabase.auth.get_user, token)
+            if not user or not user.user:
+                raise HTTPException(
+                    status_code=401,
+                    detail="Invalid authentication credentials"
+                )
+            user_id = user.user.id
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Authentication error: {str(e)}")
         raise HTTPException(
@@ -75,7 +170,16 @@ async def get_current_user(
             detail="Invalid authentication credentials"
         )
 
-# Initialize Gemini AI
+    if ttl > 0:
+        if len(_TOKEN_CACHE) >= _TOKEN_CACHE_MAX:
+            _TOKEN_CACHE.clear()
+        _TOKEN_CACHE[token] = (user_id, time.monotonic() + ttl)
+    return user_id
+
+# Initialize Gemini AI (cached per process; genai.configure runs once)
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+
+@lru_cache(maxsize=1)
 def get_gemini():
     """Initialize and return Gemini AI model."""
     try:
@@ -83,7 +187,7 @@ def get_gemini():
         if not api_key:
             raise ValueError("Missing Google API key")
         genai.configure(api_key=api_key)
-        return genai.GenerativeModel('gemini-1.5-flash')
+        return genai.GenerativeModel(GEMINI_MODEL_NAME)
     except Exception as e:
         logger.error(f"Failed to initialize Gemini AI: {str(e)}")
         raise HTTPException(status_code=500, detail="AI model initialization failed")
@@ -118,7 +222,7 @@ async def get_me(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         supabase = get_supabase()
         # Use the token directly to get user info
-        user = supabase.auth.get_user(credentials.credentials)
+        user = await _to_thread(supabase.auth.get_user, credentials.credentials)
         if not user or not user.user:
             raise HTTPException(status_code=404, detail="User not found")
         return {"id": user.user.id, "email": user.user.email}
@@ -130,7 +234,7 @@ async def get_me(credentials: HTTPAuthorizationCredentials = Depends(security)):
 async def login(user_auth: UserAuth):
     try:
         supabase = get_supabase()
-        response = supabase.auth.sign_in_with_password({
+        response = await _to_thread(supabase.auth.sign_in_with_password, {
             "email": user_auth.email,
             "password": user_auth.password
         })
@@ -143,7 +247,7 @@ async def login(user_auth: UserAuth):
 async def signup(user_auth: UserAuth):
     try:
         supabase = get_supabase()
-        response = supabase.auth.sign_up({
+        response = await _to_thread(supabase.auth.sign_up, {
             "email": user_auth.email,
             "password": user_auth.password
         })
@@ -162,20 +266,37 @@ async def process_document(
     try:
         supabase = get_supabase()
         model = get_gemini()
-        
-        # Read PDF file
-        pdf_bytes = await file.read()
-        
+
+        # Reject oversized uploads before buffering anything
+        if file.size and file.size > MAX_PDF_BYTES:
+            raise HTTPException(status_code=413, detail="PDF too large")
+
         # Check if document exists
-        existing = supabase.table('documents') \
-            .select('*') \
-            .eq('file_name', file.filename) \
-            .eq('user_id', user_id) \
-            .execute()
-            
+        existing = await _to_thread(
+            supabase.table('documents')
+            .select('id')
+            .eq('file_name', file.filename)
+            .eq('user_id', user_id)
+            .execute
+        )
+
         if existing.data:
             raise HTTPException(status_code=400, detail="Document already exists")
-        
+
+        # Stream the PDF into a spooled temp file in chunks; large uploads
+        # spill to disk instead of tripling resident memory
+        pdf_file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+        total_bytes = 0
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            total_bytes += len(chunk)
+            if total_bytes > MAX_PDF_BYTES:
+                raise HTTPException(status_code=413, detail="PDF too large")
+            pdf_file.write(chunk)
+
+        # Gemini needs the payload inline, so read it back once
+        pdf_file.seek(0)
+        pdf_bytes = pdf_file.read()
+
         # Process with Gemini AI
         prompt = """
         Analyze this document and extract all possible information.
@@ -196,49 +317,51 @@ async def process_document(
         """
         
         image_parts = [{"mime_type": "application/pdf", "data": pdf_bytes}]
-        response = model.generate_content([prompt, image_parts[0]])
+
+        # One clock read per request; the random suffix prevents collisions
+        # between rapid concurrent uploads of the same filename
+        now = datetime.now(timezone.utc)
+        storage_file_name = (
+            f"passports/{now.strftime('%Y%m%d_%H%M%S')}_"
+            f"{secrets.token_hex(4)}_{file.filename}"
+        )
+
+        def upload_to_storage():
+            pdf_file.seek(0)
+            bucket = supabase.storage.from_("documents")
+            bucket.upload(
+                path=storage_file_name,
+                file=pdf_file,
+                file_options={"content-type": "application/pdf"}
+            )
+            return bucket.get_public_url(storage_file_name)
+
+        # The Gemini extraction and the storage upload are independent
+        # multi-second I/O operations, so run them concurrently
+        response, pdf_url = await asyncio.gather(
+            asyncio.to_thread(model.generate_content, [prompt, image_parts[0]]),
+            asyncio.to_thread(upload_to_storage)
+        )
         response.resolve()
-        
+
         # Parse AI response
-        json_str = response.text.strip()
-        if json_str.startswith("```json"):
-            json_str = json_str[7:-3]
-        elif json_str.startswith("```"):
-            json_str = json_str[3:-3]
-        
-        parsed_data = json.loads(json_str)
+        parsed_data = _parse_gemini_json(response.text)
         extracted_data = {
             field['field_name'].strip(): str(field['field_value']).strip()
             for field in parsed_data.get('fields', [])
             if field.get('field_name') and field.get('field_value')
         }
-        
-        # Upload PDF to storage
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        storage_file_name = f"passports/{timestamp}_{file.filename}"
-        
-        supabase.storage \
-            .from_("documents") \
-            .upload(
-                path=storage_file_name,
-                file=pdf_bytes,
-                file_options={"content-type": "application/pdf"}
-            )
-        
-        pdf_url = supabase.storage \
-            .from_("documents") \
-            .get_public_url(storage_file_name)
-        
+
         # Save document metadata
         document_data = {
             'user_id': user_id,
             'document_type': parsed_data['document_type'],
             'file_name': file.filename,
-            'processed_at': datetime.utcnow().isoformat(),
+            'processed_at': now.isoformat(),
             'pdf_url': pdf_url
         }
         
-        doc_result = supabase.table('documents').insert(document_data).execute()
+        doc_result = await _to_thread(supabase.table('documents').insert(document_data).execute)
         document_id = doc_result.data[0]['id']
         
         # Save extracted fields
@@ -253,62 +376,205 @@ async def process_document(
         ]
         
         if data_points:
-            supabase.table('data_points').insert(data_points).execute()
-        
+            await _to_thread(supabase.table('data_points').insert(data_points).execute)
+
+        # New document: the cached document list is now stale
+        DOC_CACHE.pop(user_id, None)
+
         return {
             "document_id": document_id,
             "fields": extracted_data,
             "pdf_url": pdf_url
         }
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Document processing error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/documents", response_model=List[DocumentResponse])
-async def get_documents(user_id: str = Depends(get_current_user)):
+@app.post("/documents/process_batch")
+async def process_documents_batch(
+    files: List[UploadFile] = File(...),
+    user_id: str = Depends(get_current_user)):
+    """Process several PDFs with a single Gemini call sharing one prompt."""
     try:
-        logger.info(f"Fetching documents for user: {user_id}")
         supabase = get_supabase()
-        
-        # Fetch documents
-        documents = supabase.table('documents') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .order('created_at', desc=True) \
-            .execute()
-        
-        logger.info(f"Found {len(documents.data)} documents")
-        
-        # Fetch data points
-        data_points = supabase.table('data_points') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .execute()
-        
-        logger.info(f"Found {len(data_points.data)} data points")
-        
-        # Organize data
-        result = []
-        for doc in documents.data:
-            doc_fields = {
-                point['field_name']: point['field_value']
-                for point in data_points.data
-                if point['document_id'] == doc['id']
+        model = get_gemini()
+
+        # Read and size-check every file up front
+        pdf_payloads = []
+        for upload in files:
+            if upload.size and upload.size > MAX_PDF_BYTES:
+                raise HTTPException(status_code=413, detail=f"PDF too large: {upload.filename}")
+            pdf_bytes = await upload.read()
+            if len(pdf_bytes) > MAX_PDF_BYTES:
+                raise HTTPException(status_code=413, detail=f"PDF too large: {upload.filename}")
+            pdf_payloads.append(pdf_bytes)
+
+        # Reject the batch if any document already exists
+        file_names = [upload.filename for upload in files]
+        existing = await _to_thread(
+            supabase.table('documents')
+            .select('file_name')
+            .eq('user_id', user_id)
+            .in_('file_name', file_names)
+            .execute
+        )
+        if existing.data:
+            duplicates = ", ".join(doc['file_name'] for doc in existing.data)
+            raise HTTPException(status_code=400, detail=f"Documents already exist: {duplicates}")
+
+        # One prompt shared across all PDFs; the model answers per input, in order
+        prompt = """
+        Analyze each of the attached documents and extract all possible information.
+        Return one entry per attached document, in the same order, in the
+        following JSON format:
+        {
+            "documents": [
+                {
+                    "fields": [
+                        {
+                            "field_name": "full_name",
+                            "field_value": "JOHN DOE"
+                        }
+                    ],
+                    "document_type": "choose from passport, visa, driver's license, employer info, education, etc."
+                }
+            ]
+        }
+        """
+
+        parts = [prompt] + [
+            {"mime_type": "application/pdf", "data": pdf_bytes}
+            for pdf_bytes in pdf_payloads
+        ]
+
+        now = datetime.now(timezone.utc)
+        timestamp = now.strftime("%Y%m%d_%H%M%S")
+
+        def upload_to_storage(index):
+            storage_file_name = (
+                f"passports/{timestamp}_{secrets.token_hex(4)}_{file_names[index]}"
+            )
+            bucket = supabase.storage.from_("documents")
+            bucket.upload(
+                path=storage_file_name,
+                file=pdf_payloads[index],
+                file_options={"content-type": "application/pdf"}
+            )
+            return bucket.get_public_url(storage_file_name)
+
+        # One Gemini call for the whole batch, overlapped with all uploads
+        response, *pdf_urls = await asyncio.gather(
+            asyncio.to_thread(model.generate_content, parts),
+            *[asyncio.to_thread(upload_to_storage, i) for i in range(len(files))]
+        )
+        response.resolve()
+
+        parsed_batch = _parse_gemini_json(response.text).get('documents', [])
+        if len(parsed_batch) != len(files):
+            raise ValueError("Gemini returned a different number of documents than were uploaded")
+
+        processed_at = now.isoformat()
+        document_rows = [
+            {
+                'user_id': user_id,
+                'document_type': parsed.get('document_type', 'unknown'),
+                'file_name': file_names[i],
+                'processed_at': processed_at,
+                'pdf_url': pdf_urls[i]
             }
-            
-            result.append(DocumentResponse(
-                id=doc['id'],
-                file_name=doc['file_name'],
-                document_type=doc['document_type'],
-                pdf_url=doc.get('pdf_url'),
-                processed_at=doc['processed_at'],
-                fields=doc_fields
-            ))
-        
-        logger.info(f"Returning {len(result)} processed documents")
-        return result
-        
+            for i, parsed in enumerate(parsed_batch)
+        ]
+
+        # One bulk insert for all documents, one for all extracted fields
+        doc_result = await _to_thread(
+            supabase.table('documents').insert(document_rows).execute
+        )
+
+        results = []
+        data_points = []
+        for i, parsed in enumerate(parsed_batch):
+            document_id = doc_result.data[i]['id']
+            extracted_data = {
+                field['field_name'].strip(): str(field['field_value']).strip()
+                for field in parsed.get('fields', [])
+                if field.get('field_name') and field.get('field_value')
+            }
+            data_points.extend(
+                {
+                    'document_id': document_id,
+                    'user_id': user_id,
+                    'field_name': field_name,
+                    'field_value': field_value
+                }
+                for field_name, field_value in extracted_data.items()
+            )
+            results.append({
+                "document_id": document_id,
+                "file_name": file_names[i],
+                "fields": extracted_data,
+                "pdf_url": pdf_urls[i]
+            })
+
+        if data_points:
+            await _to_thread(supabase.table('data_points').insert(data_points).execute)
+
+        DOC_CACHE.pop(user_id, None)
+
+        return {"documents": results}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch document processing error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/documents")
+async def get_documents(user_id: str = Depends(get_current_user)):
+    """Stream the user's documents as a JSON array (shape: DocumentResponse)."""
+    try:
+        rows = DOC_CACHE.get(user_id)
+        if rows is None:
+            logger.info(f"Fetching documents for user: {user_id}")
+            supabase = get_supabase()
+
+            # Fetch documents with their data points in a single server-side join
+            documents = await _to_thread(
+                supabase.table('documents')
+                .select('id,file_name,document_type,pdf_url,processed_at,'
+                        'data_points(field_name,field_value)')
+                .eq('user_id', user_id)
+                .order('created_at', desc=True)
+                .execute
+            )
+
+            logger.info(f"Found {len(documents.data)} documents")
+
+            rows = [
+                {
+                    'id': doc['id'],
+                    'file_name': doc['file_name'],
+                    'document_type': doc['document_type'],
+                    'pdf_url': doc.get('pdf_url'),
+                    'processed_at': doc['processed_at'],
+                    'fields': _doc_fields(doc)
+                }
+                for doc in documents.data
+            ]
+            DOC_CACHE[user_id] = rows
+
+        # Serialize incrementally: one document per chunk, so time-to-first-
+        # byte and peak memory stay flat as the result set grows
+        async def generate():
+            yield b'['
+            for i, row in enumerate(rows):
+                yield (b',' if i else b'') + orjson.dumps(row)
+            yield b']'
+
+        return StreamingResponse(generate(), media_type='application/json')
+
     except Exception as e:
         logger.error(f"Error fetching documents: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -317,48 +583,98 @@ async def get_documents(user_id: str = Depends(get_current_user)):
 async def search_documents(
     query: str,
     min_score: int = 60,
+    limit: int = 50,
     user_id: str = Depends(get_current_user)
 ):
     try:
         supabase = get_supabase()
-        
-        # Fetch user's documents and data points
-        documents = supabase.table('documents') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .execute()
-        
-        data_points = supabase.table('data_points') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .execute()
-        
-        # Organize data for searching
-        results = []
+
+        # Preferred path: trigram similarity search inside Postgres
+        # (supabase/search.sql); scales with matching rows, not total rows
+        try:
+            rpc = await _to_thread(
+                supabase.rpc('search_fields', {
+                    'uid': user_id,
+                    'q': query,
+                    'min_score': min_score / 100.0,
+                    'k': limit
+                }).execute
+            )
+        except Exception as e:
+            logger.warning(f"pg_trgm search unavailable, scoring in-process: {str(e)}")
+        else:
+            hits = rpc.data or []
+            if not hits:
+                return []
+
+            doc_ids = list({hit['document_id'] for hit in hits})
+            docs = await _to_thread(
+                supabase.table('documents')
+                .select('id,file_name,pdf_url')
+                .in_('id', doc_ids)
+                .execute
+            )
+            doc_map = {doc['id']: doc for doc in docs.data}
+
+            return [
+                SearchResult(
+                    field_name=hit['field_name'],
+                    field_value=hit['field_value'],
+                    document_name=doc_map[hit['document_id']]['file_name'],
+                    pdf_url=doc_map[hit['document_id']].get('pdf_url'),
+                    match_score=round(hit['score'] * 100, 1)
+                )
+                for hit in hits
+                if hit['document_id'] in doc_map
+            ]
+
+        # Fallback: fetch user's documents with their data points in one round-trip
+        documents = await _to_thread(
+            supabase.table('documents')
+            .select('id,file_name,pdf_url,data_points(field_name,field_value)')
+            .eq('user_id', user_id)
+            .execute
+        )
+
+        # Organize data for searching; normalize the query and every field
+        # exactly once up front (lowercase, strip punctuation and whitespace)
+        q = fuzz_utils.default_process(query)
+        entries = []
+        choices = []
         for doc in documents.data:
-            doc_fields = {
-                point['field_name']: point['field_value']
-                for point in data_points.data
-                if point['document_id'] == doc['id']
-            }
-            
-            for field_name, field_value in doc_fields.items():
-                name_score = fuzz.partial_ratio(query.lower(), field_name.lower())
-                value_score = fuzz.partial_ratio(query.lower(), str(field_value).lower())
-                max_score = max(name_score, value_score)
-                
+            for field_name, field_value in _doc_fields(doc).items():
+                entries.append((field_name, field_value, doc))
+                choices.append(fuzz_utils.default_process(field_name))
+                choices.append(fuzz_utils.default_process(str(field_value)))
+
+        results = []
+        if entries:
+            # Score all (query, field) pairs in one batched C++ call; both
+            # sides are pre-normalized, so skip RapidFuzz's own processor and
+            # let score_cutoff terminate unreachable comparisons early
+            scores = fuzz_process.cdist(
+                [q],
+                choices,
+                scorer=fuzz.WRatio,
+                processor=None,
+                score_cutoff=min_score,
+                workers=-1
+            )[0]
+
+            for i, (field_name, field_value, doc) in enumerate(entries):
+                max_score = max(scores[2 * i], scores[2 * i + 1])
+
                 if max_score >= min_score:
                     results.append(SearchResult(
                         field_name=field_name,
                         field_value=field_value,
                         document_name=doc['file_name'],
                         pdf_url=doc.get('pdf_url'),
-                        match_score=max_score
+                        match_score=float(max_score)
                     ))
         
-        # Sort by match score
-        results.sort(key=lambda x: x.match_score, reverse=True)
-        return results
+        # Keep only the top-K matches; O(N log K) instead of a full sort
+        return heapq.nlargest(limit, results, key=lambda x: x.match_score)
         
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
@@ -374,32 +690,52 @@ async def categorize_fields(user_id: str = Depends(get_current_user)):
         supabase = get_supabase()
         model = get_gemini()
         
-        # Fetch all documents and their fields
-        documents = supabase.table('documents') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .execute()
-            
-        data_points = supabase.table('data_points') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .execute()
-            
+        # Fetch all documents and their fields in a single joined query
+        documents = await _to_thread(
+            supabase.table('documents')
+            .select('id,data_points(field_name,field_value)')
+            .eq('user_id', user_id)
+            .execute
+        )
+
         # Organize fields
         all_fields = {}
         for doc in documents.data:
-            doc_fields = {
-                point['field_name']: point['field_value']
-                for point in data_points.data
-                if point['document_id'] == doc['id']
-            }
-            all_fields.update(doc_fields)
-            
+            all_fields.update(_doc_fields(doc))
+
+
         if not all_fields:
             return {"categories": {}}
-            
+
+        # Categorization is deterministic per field set, so cache on its hash
+        fields_hash = hashlib.blake2b(
+            orjson.dumps(all_fields, option=orjson.OPT_SORT_KEYS)
+        ).hexdigest()
+        cache_key = (user_id, fields_hash)
+        cached = CATEGORY_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Next stop: the persisted results from previous Gemini calls
+        # (supabase/field_categories.sql), shared across workers and restarts
+        try:
+            stored = await _to_thread(
+                supabase.table('field_categories')
+                .select('categories')
+                .eq('user_id', user_id)
+                .eq('fields_hash', fields_hash)
+                .execute
+            )
+        except Exception as e:
+            logger.warning(f"field_categories lookup failed: {str(e)}")
+        else:
+            if stored.data:
+                categorized_data = stored.data[0]['categories']
+                CATEGORY_CACHE[cache_key] = categorized_data
+                return categorized_data
+
         # Prepare prompt for Gemini
-        fields_json = json.dumps(all_fields, indent=2)
+        fields_json = orjson.dumps(all_fields, option=orjson.OPT_INDENT_2).decode()
         prompt = """
         Analyze these fields and values and categorize them into logical groups.
         Fields and values to analyze:
@@ -424,33 +760,38 @@ async def categorize_fields(user_id: str = Depends(get_current_user)):
         Only include categories that have matching fields. Format field names in a human-readable way.
         """
         
-        response = model.generate_content(prompt)
+        response = await _to_thread(model.generate_content, prompt)
         response.resolve()
-        
-        # Parse the response
-        response_text = response.text.strip()
-        # Extract JSON content from markdown code block if present
-        if "```json" in response_text:
-            response_text = response_text[response_text.find("```json") + 7:response_text.rfind("```")]
-        elif "```" in response_text:
-            response_text = response_text[response_text.find("```") + 3:response_text.rfind("```")]
-        
-        # Clean up any comments in the JSON
-        response_text = "\n".join(
-            line for line in response_text.split("\n")
-            if not line.strip().startswith("//")
-        )
-        
+
         try:
-            categorized_data = json.loads(response_text)
-            # Ensure the response has the expected structure
+            categorized_data = _parse_gemini_json(response.text)
+            # A parseable but malformed response is as transient as a JSON
+            # error: return the empty fallback without caching or persisting
+            # it, so the next call retries Gemini instead of pinning {} to
+            # this field-set hash
             if not isinstance(categorized_data, dict) or "categories" not in categorized_data:
-                categorized_data = {"categories": {}}
+                logger.error(f"Unexpected categorization shape: {response.text}")
+                return {"categories": {}}
+            CATEGORY_CACHE[cache_key] = categorized_data
+
+            # Persist so future calls (and other workers) skip Gemini entirely
+            try:
+                await _to_thread(
+                    supabase.table('field_categories').upsert({
+                        'user_id': user_id,
+                        'fields_hash': fields_hash,
+                        'categories': categorized_data,
+                        'updated_at': datetime.now(timezone.utc).isoformat()
+                    }, on_conflict='user_id,fields_hash').execute
+                )
+            except Exception as e:
+                logger.warning(f"field_categories upsert failed: {str(e)}")
+
             return categorized_data
             
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {str(e)}")
-            logger.error(f"Response text: {response_text}")
+            logger.error(f"Response text: {response.text}")
             return {"categories": {}}
         
     except Exception as e:
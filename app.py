@@ -1,8 +1,20 @@
 import streamlit as st
 import requests
+import asyncio
 import json
+import logging
+# orjson parses several times faster than the stdlib; fall back silently so
+# the app still runs where it is not installed
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+import sys
 from datetime import datetime
 import os
+import google.generativeai as genai
+from functools import lru_cache
+from supabase import create_client, Client
 
 # ============================================================================
 # Configuration and Setup
@@ -28,6 +40,231 @@ if 'user' not in st.session_state:
 if 'access_token' not in st.session_state:
     st.session_state.access_token = None
 
+# ============================================================================
+# Backend Helpers
+# ============================================================================
+
+EXTRACTION_PROMPT = """
+Analyze this document and extract all possible information.
+Return the data in the following JSON format:
+{
+    "fields": [
+        {
+            "field_name": "full_name",
+            "field_value": "JOHN DOE"
+        },
+        {
+            "field_name": "date_of_birth",
+            "field_value": "1990-01-01"
+        }
+    ]
+}
+"""
+
+@lru_cache(maxsize=1)
+def setup_logging():
+    """Configure logging to both a file and stdout.
+
+    Memoized so repeated calls return the same logger instead of re-opening
+    the log file and stacking duplicate handlers.
+    """
+    logger = logging.getLogger("dockeeper")
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+    file_handler = logging.FileHandler("dockeeper.log")
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    logger.addHandler(stream_handler)
+
+    return logger
+
+logger = logging.getLogger("dockeeper")
+
+def init_supabase():
+    """Initialize the Supabase client from environment variables."""
+    try:
+        url = os.environ.get("SUPABASE_URL")
+        key = os.environ.get("SUPABASE_KEY")
+        if not url or not key:
+            raise ValueError("Missing Supabase credentials")
+        return create_client(url, key)
+    except Exception as e:
+        logger.error(f"Failed to initialize Supabase client: {str(e)}")
+        return None
+
+def init_gemini():
+    """Initialize the Gemini AI model from environment variables."""
+    try:
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("Missing Google API key")
+        genai.configure(api_key=api_key)
+        return genai.GenerativeModel('gemini-1.5-flash')
+    except Exception as e:
+        logger.error(f"Failed to initialize Gemini AI: {str(e)}")
+        return None
+
+supabase = init_supabase()
+model = init_gemini()
+
+def get_current_user():
+    """Return the id of the currently authenticated user, or None."""
+    try:
+        user = supabase.auth.get_user()
+        if not user:
+            return None
+        return user.id
+    except Exception as e:
+        logger.error(f"Authentication error: {str(e)}")
+        return None
+
+def process_with_gemini(pdf_bytes):
+    """Extract document fields from PDF bytes using Gemini AI."""
+    try:
+        image_parts = [{"mime_type": "application/pdf", "data": pdf_bytes}]
+        response = model.generate_content([EXTRACTION_PROMPT, image_parts[0]])
+
+        # Strip an optional markdown fence in a single pass; already-bare
+        # JSON (the common case) falls straight through
+        json_str = response.text.strip()
+        json_str = json_str.removeprefix("```json").removeprefix("```") \
+                           .removesuffix("```").strip()
+
+        parsed_data = _json.loads(json_str)
+        return {
+            field['field_name'].strip(): str(field['field_value']).strip()
+            for field in parsed_data.get('fields', [])
+            if field.get('field_name') and field.get('field_value')
+        }
+    except Exception as e:
+        logger.error(f"Document processing error: {str(e)}")
+        return None
+
+def check_document_exists(file_name):
+    """Check whether a document with this file name already exists for the user."""
+    try:
+        user_id = get_current_user()
+        existing = supabase.table('documents') \
+            .select('*') \
+            .eq('file_name', file_name) \
+            .eq('user_id', user_id) \
+            .execute()
+        return bool(existing.data)
+    except Exception as e:
+        logger.error(f"Document lookup error: {str(e)}")
+        return False
+
+def upload_pdf_to_storage(pdf_bytes, file_name):
+    """Upload PDF bytes to Supabase storage and return the public URL."""
+    try:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        storage_file_name = f"passports/{timestamp}_{file_name}"
+
+        bucket = supabase.storage.from_("documents")
+        bucket.upload(
+            path=storage_file_name,
+            file=pdf_bytes,
+            file_options={"content-type": "application/pdf"}
+        )
+        return bucket.get_public_url(storage_file_name)
+    except Exception as e:
+        logger.error(f"PDF upload error: {str(e)}")
+        return None
+
+def save_to_supabase(extracted_data, file_name, pdf_bytes):
+    """Save a processed document and its extracted fields; return the document id."""
+    try:
+        if check_document_exists(file_name):
+            logger.warning(f"Document already exists: {file_name}")
+            return None
+
+        user_id = get_current_user()
+        pdf_url = upload_pdf_to_storage(pdf_bytes, file_name)
+
+        document_data = {
+            'user_id': user_id,
+            'document_type': 'passport',
+            'file_name': file_name,
+            'processed_at': datetime.utcnow().isoformat(),
+            'pdf_url': pdf_url
+        }
+
+        doc_result = supabase.table('documents').insert(document_data).execute()
+        document_id = doc_result.data[0]['id']
+
+        # One bulk insert for all fields instead of a round-trip per field
+        rows = [
+            {
+                'document_id': document_id,
+                'user_id': user_id,
+                'field_name': field_name,
+                'field_value': field_value
+            }
+            for field_name, field_value in extracted_data.items()
+        ]
+        if rows:
+            supabase.table('data_points').insert(rows).execute()
+
+        return document_id
+    except Exception as e:
+        logger.error(f"Document save error: {str(e)}")
+        return None
+
+async def process_with_gemini_async(pdf_bytes):
+    """Async wrapper running the blocking Gemini call on the threadpool."""
+    return await asyncio.to_thread(process_with_gemini, pdf_bytes)
+
+async def upload_pdf_to_storage_async(pdf_bytes, file_name):
+    """Async wrapper running the blocking storage upload on the threadpool."""
+    return await asyncio.to_thread(upload_pdf_to_storage, pdf_bytes, file_name)
+
+async def extract_and_upload(pdf_bytes, file_name):
+    """Run Gemini extraction and the storage upload concurrently.
+
+    The two calls are independent network operations, so total latency is
+    max(extraction, upload) rather than their sum. Returns
+    (extracted_data, pdf_url).
+    """
+    return await asyncio.gather(
+        process_with_gemini_async(pdf_bytes),
+        upload_pdf_to_storage_async(pdf_bytes, file_name),
+    )
+
+def fetch_all_documents():
+    """Fetch all documents with their fields, keyed by document id."""
+    try:
+        user_id = get_current_user()
+        if not user_id:
+            return None
+
+        # Embedded-resource select joins data_points server-side: one HTTP
+        # round-trip instead of two sequential queries
+        documents = supabase.table('documents') \
+            .select('*, data_points(field_name, field_value)') \
+            .eq('user_id', user_id) \
+            .order('created_at', desc=True) \
+            .execute()
+
+        result = {}
+        for doc in documents.data:
+            doc_fields = {
+                point['field_name']: point['field_value']
+                for point in doc.get('data_points') or []
+            }
+            # Copy before dropping the raw join rows; callers may share doc
+            entry = {**doc, 'fields': doc_fields}
+            entry.pop('data_points', None)
+            result[doc['id']] = entry
+
+        return result
+    except Exception as e:
+        logger.error(f"Error fetching documents: {str(e)}")
+        return None
+
 # ============================================================================
 # UI Styles
 # ============================================================================
@@ -99,10 +336,17 @@ st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 # API Client Functions
 # ============================================================================
 
+def get_http_session() -> requests.Session:
+    """Return the per-session HTTP client so connections are kept alive."""
+    if 'http' not in st.session_state:
+        st.session_state.http = requests.Session()
+    return st.session_state.http
+
 def api_login(email: str, password: str) -> bool:
     """Handle user login through API."""
     try:
-        response = requests.post(
+        session = get_http_session()
+        response = session.post(
             f"{API_URL}/auth/login",
             json={"email": email, "password": password}
         )
@@ -111,6 +355,8 @@ def api_login(email: str, password: str) -> bool:
             st.session_state.authenticated = True
             st.session_state.user = data["user_id"]
             st.session_state.access_token = data["access_token"]
+            # Send the bearer token on every subsequent request
+            session.headers['Authorization'] = f"Bearer {data['access_token']}"
             return True
         return False
     except Exception as e:
@@ -120,7 +366,7 @@ def api_login(email: str, password: str) -> bool:
 def api_signup(email: str, password: str) -> bool:
     """Handle user signup through API."""
     try:
-        response = requests.post(
+        response = get_http_session().post(
             f"{API_URL}/auth/signup",
             json={"email": email, "password": password}
         )
@@ -133,11 +379,9 @@ def api_process_document(file) -> dict:
     """Process document through API."""
     try:
         files = {"file": (file.name, file, "application/pdf")}
-        headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-        response = requests.post(
+        response = get_http_session().post(
             f"{API_URL}/documents/process",
-            files=files,
-            headers=headers
+            files=files
         )
         if response.status_code == 200:
             return response.json()
@@ -151,11 +395,7 @@ def api_process_document(file) -> dict:
 def api_get_documents() -> list:
     """Fetch documents through API."""
     try:
-        headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-        response = requests.get(
-            f"{API_URL}/documents",
-            headers=headers
-        )
+        response = get_http_session().get(f"{API_URL}/documents")
         if response.status_code == 200:
             return response.json()
         elif response.status_code == 401:
@@ -170,11 +410,9 @@ def api_get_documents() -> list:
 def api_search_documents(query: str, min_score: int = 60) -> list:
     """Search documents through API."""
     try:
-        headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-        response = requests.get(
+        response = get_http_session().get(
             f"{API_URL}/documents/search",
-            params={"query": query, "min_score": min_score},
-            headers=headers
+            params={"query": query, "min_score": min_score}
         )
         if response.status_code == 200:
             return response.json()
@@ -187,6 +425,16 @@ def api_search_documents(query: str, min_score: int = 60) -> list:
         st.error(f"Error searching documents: {str(e)}")
         return []
 
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_search_documents(query: str, min_score: int, token: str) -> list:
+    """Cache search results per (query, token) so reruns skip the backend."""
+    return api_search_documents(query, min_score)
+
+@st.cache_data(ttl=10, show_spinner=False)
+def cached_get_documents(token: str) -> list:
+    """Cache the document list briefly; invalidated after uploads."""
+    return api_get_documents()
+
 # ============================================================================
 # UI Components
 # ============================================================================
@@ -217,10 +465,14 @@ def render_search_tab():
     search_term = st.text_input("Enter search term", 
                                help="Search through your documents. The search is smart and will find partial matches.")
     
-    if search_term:
+    if search_term and len(search_term) < 3:
+        st.info("Type at least 3 characters to search")
+    elif search_term:
         with st.spinner("Searching..."):
-            results = api_search_documents(search_term)
-            
+            results = cached_search_documents(
+                search_term, 60, st.session_state.access_token
+            )
+
             if not results:
                 st.info("No matches found. Try using different search terms.")
             else:
@@ -265,6 +517,8 @@ def render_upload_tab():
                 result = api_process_document(uploaded_file)
                 
                 if result:
+                    # Cached document list and searches are now stale
+                    st.cache_data.clear()
                     st.success("Document processed successfully!")
                     display_data_card(result["fields"])
                     
@@ -281,7 +535,7 @@ def render_view_tab():
     st.markdown("### View Processed Documents")
     
     with st.spinner("Fetching documents..."):
-        documents = api_get_documents()
+        documents = cached_get_documents(st.session_state.access_token)
         
         if not documents:
             st.info("No documents found.")
@@ -353,6 +607,7 @@ def handle_logout():
     st.session_state.authenticated = False
     st.session_state.user = None
     st.session_state.access_token = None
+    get_http_session().headers.pop('Authorization', None)
     st.success("Successfully logged out!")
     st.rerun()
 
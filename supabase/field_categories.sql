@@ -0,0 +1,28 @@
+-- Persisted Gemini categorization results. Categorization is deterministic
+-- per field set, so the LLM output is stored keyed on a hash of the input and
+-- reused across processes and restarts instead of re-billing tokens.
+create table if not exists public.field_categories (
+    id uuid default gen_random_uuid() primary key,
+    user_id uuid references auth.users(id),
+    fields_hash text not null,
+    categories jsonb not null,
+    updated_at timestamp with time zone default timezone('utc'::text, now()),
+    unique (user_id, fields_hash)
+);
+
+alter table public.field_categories enable row level security;
+
+create policy "Users can insert their own field categories"
+    on public.field_categories
+    for insert
+    with check (auth.uid() = user_id);
+
+create policy "Users can view their own field categories"
+    on public.field_categories
+    for select
+    using (auth.uid() = user_id);
+
+create policy "Users can update their own field categories"
+    on public.field_categories
+    for update
+    using (auth.uid() = user_id);
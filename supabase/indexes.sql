@@ -0,0 +1,17 @@
+-- Composite indexes for the hot query paths. Every endpoint filters both
+-- tables by user_id and joins data_points on document_id, so without these
+-- Postgres falls back to sequential scans that grow with total rows across
+-- all users.
+--
+-- CONCURRENTLY avoids taking a table lock in production; note it cannot run
+-- inside a transaction block, so apply this file statement by statement.
+
+create index concurrently if not exists idx_documents_user_id_created_at
+    on public.documents (user_id, created_at desc);
+
+create index concurrently if not exists idx_data_points_user_id_document_id
+    on public.data_points (user_id, document_id);
+
+-- The unique (user_id, file_name) index lives in unique_documents.sql: it
+-- needs a dedup precondition and can leave an INVALID index on failure, so
+-- it is applied as its own deliberate step rather than alongside these.
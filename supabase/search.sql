@@ -0,0 +1,48 @@
+-- Trigram-based fuzzy search pushed down into Postgres
+create extension if not exists pg_trgm;
+
+-- GIN trigram indexes backing the % operator filter in search_fields below.
+-- Postgres only uses trgm indexes for the %/<% operators (or <-> ordering),
+-- so the function must filter with %, not similarity(), for these to matter.
+create index if not exists idx_data_points_field_value_trgm
+    on public.data_points using gin (field_value gin_trgm_ops);
+
+create index if not exists idx_data_points_field_name_trgm
+    on public.data_points using gin (field_name gin_trgm_ops);
+
+-- RPC called from the API: returns the top k fields for a user whose name or
+-- value is trigram-similar to the query (score in [0, 1])
+create or replace function public.search_fields(
+    uid uuid,
+    q text,
+    min_score real default 0.3,
+    k int default 50
+)
+returns table (
+    field_name text,
+    field_value text,
+    document_id uuid,
+    score real
+)
+language plpgsql
+as $$
+begin
+    -- % filters against pg_trgm.similarity_threshold; align it with
+    -- min_score so the index-backed operator matches the requested cutoff
+    perform set_limit(min_score);
+    return query
+    select
+        dp.field_name,
+        dp.field_value,
+        dp.document_id,
+        greatest(
+            similarity(dp.field_name, q),
+            similarity(dp.field_value, q)
+        ) as score
+    from public.data_points dp
+    where dp.user_id = uid
+      and (dp.field_name % q or dp.field_value % q)
+    order by 4 desc
+    limit k;
+end;
+$$;
@@ -0,0 +1,22 @@
+-- Unique (user_id, file_name) on documents: makes the duplicate check in
+-- process_document an index lookup and enforces the "already exists"
+-- invariant at the database instead of racing in Python.
+--
+-- PRECONDITION: the table must already be duplicate-free, or the build
+-- fails. Check first:
+--
+--     select user_id, file_name, count(*)
+--     from public.documents
+--     group by user_id, file_name
+--     having count(*) > 1;
+--
+-- Resolve any rows this returns (keep the newest, delete or rename the
+-- rest) before applying. If the build does fail, CONCURRENTLY leaves an
+-- INVALID index behind that must be dropped manually:
+--
+--     drop index concurrently if exists uq_documents_user_id_file_name;
+--
+-- then dedup and re-run.
+
+create unique index concurrently if not exists uq_documents_user_id_file_name
+    on public.documents (user_id, file_name);